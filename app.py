@@ -1,10 +1,16 @@
 import streamlit as st
-import fitz
-import json
+import hashlib
 import os
 import pandas as pd
 import re
-from openai import OpenAI
+import threading
+
+try:
+    from orjson import loads as _loads, dumps as _dumps  # פענוח מהיר של תשובת המודל
+except ImportError:
+    import json
+    _loads = json.loads
+    def _dumps(obj): return json.dumps(obj, ensure_ascii=False).encode()  # bytes, כמו orjson
 
 # הגדרות RTL ועיצוב קשיח - חסימת כל אפשרות לעיגול או פרשנות
 st.set_page_config(page_title="מנתח פנסיה - גירסה 28.0 (דיוק מוחלט)", layout="wide")
@@ -20,24 +26,44 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# לקוח יחיד לכל מפתח - שומר על מאגר החיבורים (TLS keep-alive) בין ריצות חוזרות של הסקריפט
+@st.cache_resource
+def openai_client(api_key):
+    from openai import OpenAI  # טעינת openai (httpx, pydantic) פעם אחת בלבד, בתוך ה-factory השמור
+    # תקרה לתקיעה: ברירת המחדל של ה-SDK היא 10 דקות; בסטרימינג המגבלה חלה על ההמתנה בין חלקי התשובה
+    return OpenAI(api_key=api_key, timeout=120.0)
+
 def init_client():
+    # המפתח נקרא בכל ריצה ו-None לא נשמר במטמון - מפתח שנוסף ל-secrets מאוחר יותר נקלט בלי הפעלה מחדש
     api_key = st.secrets.get("OPENAI_API_KEY") or os.getenv("OPENAI_API_KEY")
-    return OpenAI(api_key=api_key) if api_key else None
+    return openai_client(api_key) if api_key else None
+
+# נרמול תווים בודדים במעבר אחד (C) לפני ה-regex: פסיקים יוצאים, כל סוגי המינוס/מקף הופכים ל-"-"
+_NUM_NORMALIZE = str.maketrans({",": None, "−": "-", "–": "-", "—": "-"})
+_NON_NUMERIC_RE = re.compile(r'[^\d\.\-]')
+_NUMBER_RE = re.compile(r'-?(?:\d+\.?\d*|\.\d+)')
 
 def clean_num(val):
     if val is None or val == "" or str(val).strip() in ["-", "nan", ".", "0"]: return 0.0
-    try:
-        cleaned = re.sub(r'[^\d\.\-]', '', str(val).replace(",", "").replace("−", "-"))
-        return float(cleaned) if cleaned else 0.0
-    except: return 0.0
+    cleaned = _NON_NUMERIC_RE.sub('', str(val).translate(_NUM_NORMALIZE))
+    # בדיקה מפורשת במקום try/except - זריקת חריגה יקרה, ו-clean_num רצה על כל תא
+    return float(cleaned) if _NUMBER_RE.fullmatch(cleaned) else 0.0
+
+def markers_pattern(markers):
+    # חלופה אחת לכל המונחים, בכתיב רגיל ובכתיב הפוך (טקסט RTL שחולץ הפוך) - סריקה אחת במקום לולאת in
+    return re.compile("|".join(map(re.escape, tuple(markers) + tuple(m[::-1] for m in markers))))
+
+# זיהוי שורת ההפקדות בטבלה ב'
+_DEPOSIT_MARKERS = ("הופקדו", "כספים שהופקדו")
+_DEPOSIT_RE = markers_pattern(_DEPOSIT_MARKERS)
 
 def perform_cross_validation(data):
     """אימות הצלבה קשיח בין טבלה ב' ל-ה'"""
     dep_b = 0.0
     for r in data.get("table_b", {}).get("rows", []):
-        row_str = " ".join(str(v) for v in r.values())
-        if any(kw in row_str for kw in ["הופקדו", "כספים שהופקדו"]):
-            nums = [clean_num(v) for v in r.values() if clean_num(v) > 10]
+        row_str = " ".join([str(v) for v in r.values()])
+        if _DEPOSIT_RE.search(row_str):
+            nums = [n for n in map(clean_num, r.values()) if n > 10]
             if nums: dep_b = nums[0]
             break
             
@@ -58,8 +84,29 @@ def display_pension_table(rows, title, col_order):
     st.subheader(title)
     st.table(df)
 
-def process_audit_v28(client, text):
-    prompt = f"""You are a RAW TEXT TRANSCRIBER. Your ONLY job is to copy characters from the text to JSON.
+def is_pdf_upload(uploaded_file):
+    # בדיקת חתימת PDF מתחילת הקובץ בלבד - בלי לטעון את כולו לזיכרון
+    head = uploaded_file.read(1024)
+    uploaded_file.seek(0)
+    return b"%PDF-" in head
+
+# כיווץ רווחים ושורות ריקות לפני השליחה למודל - פחות טוקנים, אותו מידע
+_SPACE_RUN_RE = re.compile(r"[ \t]{2,}")
+_LINE_BREAK_RE = re.compile(r"\s*\n\s*")
+
+def compact_text(text):
+    return _LINE_BREAK_RE.sub("\n", _SPACE_RUN_RE.sub(" ", text)).strip()
+
+# חילוץ הטקסט דטרמיניסטי בתוכן הקובץ - נשמר בין ריצות ובין משתמשים
+# המפתח הוא ה-blake2b של הקובץ (key); פרמטר שמתחיל ב-_ לא נכנס למפתח, כך ש-Streamlit לא מגבב שוב את כל הבתים
+@st.cache_data(show_spinner=False, max_entries=32)
+def extract_pdf_text(key, _pdf_bytes):
+    import fitz  # נטען רק כשיש באמת קובץ לעבד - לא מעכב את הצגת הדף הראשונה
+    # סגירה מפורשת של המסמך - משחרר את הזיכרון של MuPDF מיד, בלי לחכות ל-GC
+    with fitz.open(stream=_pdf_bytes, filetype="pdf") as doc:
+        return compact_text("\n".join([page.get_text() for page in doc]))
+
+_PROMPT_HEADER = """You are a RAW TEXT TRANSCRIBER. Your ONLY job is to copy characters from the text to JSON.
     
     CRITICAL INSTRUCTIONS:
     1. ZERO INTERPRETATION: Do not flip digits (e.g., 67 remains 67). 
@@ -70,24 +117,83 @@ def process_audit_v28(client, text):
        - 'מועד' and 'חודש' must be empty strings.
     
     JSON STRUCTURE:
-    {{
-      "table_a": {{"rows": [{{"תיאור": "", "סכום בש\"ח": ""}}]}},
-      "table_b": {{"rows": [{{"תיאור": "", "סכום בש\"ח": ""}}]}},
-      "table_c": {{"rows": [{{"תיאור": "", "אחוז": ""}}]}},
-      "table_d": {{"rows": [{{"מסלול": "", "תשואה": ""}}]}},
-      "table_e": {{"rows": [{{ "שם המעסיק": "", "מועד": "", "חודש": "", "שכר": "", "עובד": "", "מעסיק": "", "פיצויים": "", "סה\"כ": "" }}]}}
-    }}
-    TEXT: {text}"""
-    
-    res = client.chat.completions.create(
+"""
+
+_TABLES_STRUCTURE = """    {
+      "table_a": {"rows": [{"תיאור": "", "סכום בש\"ח": ""}]},
+      "table_b": {"rows": [{"תיאור": "", "סכום בש\"ח": ""}]},
+      "table_c": {"rows": [{"תיאור": "", "אחוז": ""}]},
+      "table_d": {"rows": [{"מסלול": "", "תשואה": ""}]},
+      "table_e": {"rows": [{ "שם המעסיק": "", "מועד": "", "חודש": "", "שכר": "", "עובד": "", "מעסיק": "", "פיצויים": "", "סה\"כ": "" }]}
+    }"""
+
+_USER_PREFIX = f"{_PROMPT_HEADER}{_TABLES_STRUCTURE}\n    TEXT: "
+
+# הודעת המערכת קבועה - נבנית פעם אחת ברמת המודול (הלקוח של OpenAI לא משנה אותה)
+_SYSTEM_MSG = {"role": "system", "content": "You are a mechanical OCR tool. You copy characters exactly. You do not use logic, you do not round, and you do not flip numbers."}
+
+# סכמת JSON קשיחה (Structured Outputs): המודל לא יכול להוסיף טקסט חופשי או שדות - פחות טוקני פלט
+_TABLE_COLUMNS = {
+    "table_a": ["תיאור", "סכום בש\"ח"],
+    "table_b": ["תיאור", "סכום בש\"ח"],
+    "table_c": ["תיאור", "אחוז"],
+    "table_d": ["מסלול", "תשואה"],
+    "table_e": ["שם המעסיק", "מועד", "חודש", "שכר", "עובד", "מעסיק", "פיצויים", "סה\"כ"],
+}
+
+_TABLE_TITLES = {
+    "table_a": "א. תשלומים צפויים",
+    "table_b": "ב. תנועות בקרן",
+    "table_c": "ג. דמי ניהול והוצאות",
+    "table_d": "ד. מסלולי השקעה",
+    "table_e": "ה. פירוט הפקדות",
+}
+
+def _strict_object(properties):
+    return {"type": "object", "additionalProperties": False, "required": list(properties), "properties": properties}
+
+_REPORT_SCHEMA = _strict_object({
+    table: _strict_object({"rows": {"type": "array", "items": _strict_object({c: {"type": "string"} for c in cols})}})
+    for table, cols in _TABLE_COLUMNS.items()
+})
+_REPORT_FORMAT = {"type": "json_schema", "json_schema": {"name": "pension_report", "strict": True, "schema": _REPORT_SCHEMA}}
+# בבקשה משותפת כל דוח חוזר עם ה-id שלו - התאמה לקובץ לפי מזהה ולא לפי מיקום ברשימה
+_REPORTS_FORMAT = {"type": "json_schema", "json_schema": {"name": "pension_reports", "strict": True, "schema": _strict_object(
+    {"reports": {"type": "array", "items": _strict_object({"id": {"type": "integer"}, **_REPORT_SCHEMA["properties"]})}})}}
+
+def completion_params(prompt, response_format=_REPORT_FORMAT):
+    # אותם פרמטרים לקריאה ישירה ולשורה בקובץ ה-Batch
+    return dict(
         model="gpt-4o",
-        messages=[{"role": "system", "content": "You are a mechanical OCR tool. You copy characters exactly. You do not use logic, you do not round, and you do not flip numbers."},
-                  {"role": "user", "content": prompt}],
+        messages=[_SYSTEM_MSG, {"role": "user", "content": prompt}],
         temperature=0, # ביטול כל "יצירתיות" או ניחושים
-        response_format={"type": "json_object"}
+        response_format=response_format
     )
-    data = json.loads(res.choices[0].message.content)
-    
+
+def request_json(client, prompt, response_format=_REPORT_FORMAT):
+    res = client.chat.completions.create(**completion_params(prompt, response_format), stream=True)
+    # קליטה הדרגתית של התשובה - משוב מיידי למשתמש במקום המתנה לתשובה המלאה
+    # הערכה גסה לאורך התשובה: הטבלאות מועתקות מהטקסט, כך שהן בסדר גודל של חצי ממנו
+    expected = max(len(prompt) // 2, 2000)
+    progress = st.progress(0.0)
+    parts, received, finish = [], 0, None
+    try:
+        for chunk in res:
+            if not chunk.choices: continue
+            finish = chunk.choices[0].finish_reason or finish
+            delta = chunk.choices[0].delta.content
+            if not delta: continue
+            parts.append(delta)
+            received += len(delta)
+            if len(parts) % 25 == 0:
+                progress.progress(min(received / expected, 0.99), text=f"התקבלו {received:,} תווים מהמודל...")
+    finally:
+        progress.empty()
+    # תשובה שנקטעה במגבלת טוקני הפלט היא JSON חלקי - עדיף להיכשל כאן ולא לפענח חצי טבלה
+    if finish == "length": raise ValueError("התשובה נקטעה במגבלת טוקני הפלט")
+    return _loads("".join(parts))
+
+def fix_extracted_tables(data):
     # תיקון הסטות וחישוב שכר ב-Python (ללא AI)
     rows_e = data.get("table_e", {}).get("rows", [])
     if len(rows_e) > 1:
@@ -102,9 +208,9 @@ def process_audit_v28(client, text):
         max_val = max(cleaned_vals)
         
         # אם המספר הכי גדול (הסה"כ) לא נמצא בעמודת הסה"כ - נזיז הכל למקום
-        if max_val > 0 and clean_num(last_row.get("סה\"כ")) != max_val:
+        if max_val > 0 and cleaned_vals[3] != max_val:
             # מציאת האינדקס של הערך המקסימלי והזזתו לעמודת הסה"כ
-            non_zero_vals = [v for v in vals if clean_num(v) > 0]
+            non_zero_vals = [v for v, n in zip(vals, cleaned_vals) if n > 0]
             if len(non_zero_vals) == 4: # הכל חולץ אבל מוסט
                 last_row["סה\"כ"] = non_zero_vals[3]
                 last_row["פיצויים"] = non_zero_vals[2]
@@ -126,40 +232,229 @@ def process_audit_v28(client, text):
     rows_d = data.get("table_d", {}).get("rows", [])
     for row in rows_d:
         rate_str = str(row.get("תשואה", "")).replace("%", "").strip()
-        try:
-            if "." in rate_str:
-                before_dot, after_dot = rate_str.split(".")
-                if len(after_dot) > len(before_dot):
-                    # היפוך נכון: שים נקודה אחרי מספר הספרות של after_dot מהסוף
-                    all_digits = before_dot + after_dot   # "710"
-                    n = len(before_dot)                   # 1
-                    reversed_digits = all_digits[::-1]    # "017"
-                    flipped = reversed_digits[:n] + "." + reversed_digits[n:]  # "0.17" ✓
-                    row["תשואה"] = flipped
-        except:
-            pass
+        if rate_str.count(".") == 1:
+            before_dot, after_dot = rate_str.split(".")
+            if len(after_dot) > len(before_dot):
+                # היפוך נכון: שים נקודה אחרי מספר הספרות של after_dot מהסוף
+                all_digits = before_dot + after_dot   # "710"
+                n = len(before_dot)                   # 1
+                reversed_digits = all_digits[::-1]    # "017"
+                flipped = reversed_digits[:n] + "." + reversed_digits[n:]  # "0.17" ✓
+                row["תשואה"] = flipped
         
     return data
+
+def process_audit_v28(client, text):
+    return fix_extracted_tables(request_json(client, _USER_PREFIX + text))
+
+# תקרת טקסט לבקשה משותפת: התשובה מעתיקה את כל שורות טבלה ה' של כל הדוחות, וחייבת להיכנס במגבלת טוקני הפלט
+_GROUP_MAX_CHARS = 40_000
+
+def group_texts(texts, max_chars=_GROUP_MAX_CHARS):
+    # חלוקה לפי סדר ההעלאה; דוח שחורג מהתקרה לבדו נשלח לבד
+    groups, size = [], 0
+    for t in texts:
+        if groups and size + len(t) <= max_chars:
+            groups[-1].append(t)
+            size += len(t)
+        else:
+            groups.append([t])
+            size = len(t)
+    return groups
+
+def process_audit_safe(client, text):
+    from openai import APIError
+    try:
+        return process_audit_v28(client, text)
+    except (APIError, ValueError) as e:
+        st.error(f"⚠️ ניתוח אחד הדוחות נכשל: {e}")
+        return {}
+
+def process_audit_group(client, texts):
+    from openai import APIError, BadRequestError
+    if len(texts) == 1: return [process_audit_safe(client, texts[0])]
+    ids = list(range(1, len(texts) + 1))
+    reports = "\n".join([f'<PENSION_REPORT id="{k}">\n{t}\n</PENSION_REPORT>' for k, t in zip(ids, texts)])
+    prompt = (f"{_PROMPT_HEADER}"
+              f'    Return {{"reports": [...]}} with exactly one object per PENSION_REPORT, carrying its id. Each object:\n'
+              f"{_TABLES_STRUCTURE}\n    REPORTS:\n{reports}")
+    try:
+        results = request_json(client, prompt, _REPORTS_FORMAT).get("reports", [])
+        by_id = {d.pop("id", None): d for d in results}
+        # דוח שהושמט, מוזג או קיבל מזהה זר - אסור לשייך טבלאות לקובץ הלא נכון
+        if len(results) != len(ids) or sorted(by_id) != ids: raise ValueError("הדוחות בתשובה לא תואמים לדוחות שנשלחו")
+    except (BadRequestError, ValueError):
+        # חריגה מהקונטקסט, תשובה קטועה או לא תואמת - כל דוח בבקשה משלו
+        return [process_audit_safe(client, t) for t in texts]
+    except APIError as e:
+        # מכסה, הרשאה או רשת - פיצול לבקשות נפרדות רק יכביד; הקבוצה נכשלת פעם אחת
+        st.error(f"⚠️ ניתוח {len(texts)} דוחות נכשל: {e}")
+        return [{}] * len(texts)
+    return [fix_extracted_tables(by_id[k]) for k in ids]
+
+def process_audit_batch(client, texts):
+    """כמה דוחות בבקשה אחת - חוסך בקשות מול מגבלת ה-RPM ואת חזרת ההנחיות לכל דוח"""
+    return [d for group in group_texts(texts) for d in process_audit_group(client, group)]
     
-# ממשק משתמש
-st.title("📋 חילוץ נתונים פנסיוני - גירסה 28.0")
-client = init_client()
+# מתחת לזה אין שכבת טקסט של ממש - PDF סרוק (תמונות בלבד)
+_MIN_TEXT_CHARS = 100
+_AUDIT_CACHE_MAX = 128
 
-if client:
-    file = st.file_uploader("העלה דוח PDF", type="pdf")
-    if file:
+# דוח פנסיה מכיל לפחות 3 מהמונחים האלה (גם בכתיב הפוך) - אחרת לא משלמים על קריאה למודל
+_REPORT_KEYWORDS = ("דמי ניהול", "הופקדו", "תשואה", "מעסיק", "פיצויים")
+_MIN_KEYWORD_HITS = 3
+
+_REPORT_KEYWORDS_RE = markers_pattern(_REPORT_KEYWORDS)
+
+def looks_like_pension_report(text):
+    # מעבר יחיד על הטקסט שנעצר ברגע שנמצאו מספיק מונחים שונים
+    hits = set()
+    for m in _REPORT_KEYWORDS_RE.finditer(text):
+        kw = m.group()
+        hits.add(kw if kw in _REPORT_KEYWORDS else kw[::-1])
+        if len(hits) >= _MIN_KEYWORD_HITS: return True
+    return False
+
+# מאגר תוצאות משותף לכל הסשנים - רק מי שמחזיק באותו קובץ בדיוק יגיע לאותו מפתח
+# הסשנים רצים ב-threads נפרדים, ולכן כל כתיבה (עדכון ופינוי) נעשית תחת המנעול
+@st.cache_resource
+def audit_cache():
+    return {}, threading.Lock()
+
+def store_results(results):
+    cache, lock = audit_cache()
+    with lock:
+        cache.update([(k, d) for k, d in results.items() if d])
+        while len(cache) > _AUDIT_CACHE_MAX: cache.pop(next(iter(cache)), None)
+
+def submit_batch(client, texts):
+    """ניתוח מושהה דרך Batch API - חצי מחיר, תוצאה תוך עד 24 שעות. texts: hash -> טקסט"""
+    lines = [_dumps({"custom_id": k, "method": "POST", "url": "/v1/chat/completions",
+                         "body": completion_params(_USER_PREFIX + t)}) for k, t in texts.items()]
+    payload = b"\n".join(lines)
+    batch_file = client.files.create(file=("pension_batch.jsonl", payload), purpose="batch")
+    return client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions", completion_window="24h").id
+
+# מצבי אצווה שעוד עשויים להשתנות; כל השאר סופיים ומוציאים את האצווה מהרשימה
+_BATCH_RUNNING = ("validating", "in_progress", "finalizing", "cancelling")
+
+def parse_batch_line(line):
+    """שורת פלט אחת -> (hash, נתונים מתוקנים); None לשורה פגומה, שגיאה או תשובה קטועה"""
+    try:
+        item = _loads(line)
+        response = item.get("response") or {}
+        if item.get("error") or response.get("status_code") != 200: return None
+        choice = response["body"]["choices"][0]
+        if choice.get("finish_reason") == "length": return None
+        return item["custom_id"], fix_extracted_tables(_loads(choice["message"]["content"]))
+    except (ValueError, TypeError, KeyError, IndexError, AttributeError):
+        return None
+
+def fetch_batch(client, batch_id):
+    """מחזיר (סטטוס, תוצאות מתוקנות לפי hash) - התוצאות ריקות כל עוד האצווה לא הסתיימה"""
+    batch = client.batches.retrieve(batch_id)
+    results = {}
+    # גם אצווה שפג תוקפה או בוטלה יכולה להחזיק קובץ פלט עם תוצאות חלקיות - שכבר שולמו
+    if batch.status not in _BATCH_RUNNING and batch.output_file_id:
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            parsed = parse_batch_line(line) if line else None
+            if parsed: results[parsed[0]] = parsed[1]
+    return batch.status, results
+
+def poll_batches(client):
+    from openai import APIError
+    pending = st.session_state.setdefault("pending_batches", {})
+    failed = st.session_state.setdefault("failed_audits", set())
+    for batch_id, keys in list(pending.items()):
+        try:
+            status, results = fetch_batch(client, batch_id)
+        except APIError as e:
+            # תקלה זמנית בבדיקה - האצווה נשארת ברשימה ונבדקת שוב בריצה הבאה
+            st.error(f"⚠️ בדיקת הניתוח המושהה נכשלה: {e}")
+            continue
+        if status in _BATCH_RUNNING:
+            st.info(f"⏳ ניתוח מושהה של {len(keys)} דוחות עדיין בעיבוד ({status}).")
+            continue
+        store_results(results)
+        del pending[batch_id]
+        missing = [k for k in keys if k not in results]
+        failed.update(missing)
+        if missing: st.error(f"⚠️ {len(missing)} מתוך {len(keys)} דוחות בניתוח המושהה לא נותחו ({status}).")
+    if pending: st.button("🔄 בדוק שוב", key="poll_batches")  # לחיצה מריצה מחדש את ה-fragment בלבד
+    return {k for keys in pending.values() for k in keys}
+
+def process_uploads(client, files, in_batch, deferred=False):
+    """תוצאות שמורות לפי hash של תוכן הקובץ - העלאה חוזרת (גם בסשן חדש) לא מפעילה שוב את המודל"""
+    from openai import APIError
+    cache, _ = audit_cache()
+    # hash התוכן מחושב פעם אחת לכל העלאה (לפי file_id) - ריצות חוזרות של ה-fragment לא קוראות ומגבבות שוב את הקבצים
+    known = st.session_state.get("upload_keys", {})
+    st.session_state["upload_keys"] = upload_keys = {
+        f.file_id: known.get(f.file_id) or hashlib.blake2b(f.getvalue(), digest_size=16).hexdigest() for f in files}
+    # דוח שניתוחו נכשל לא נשלח שוב בכל ריצה חוזרת (ומשולם שוב) - רק בלחיצה מפורשת על "נסה שוב"
+    failed = st.session_state.setdefault("failed_audits", set())
+    if not failed.isdisjoint(upload_keys.values()) and st.button("🔁 נסה שוב את הדוחות שנכשלו", key="retry_failed"):
+        failed.difference_update(upload_keys.values())
+    keys, texts = [], {}
+    for f in files:
+        k = upload_keys[f.file_id]
+        keys.append(k)
+        if k in cache or k in texts or k in in_batch or k in failed: continue
+        try:
+            text = extract_pdf_text(k, f.getvalue())
+        except RuntimeError:  # FileDataError של PyMuPDF - קובץ עם כותרת PDF אבל קטוע או פגום
+            st.error(f"⚠️ הקובץ {f.name} פגום ולא ניתן לקרוא ממנו טקסט.")
+            continue
+        # PDF סרוק - אין מה לתמלל, לא משלמים על קריאה למודל
+        if len(text) < _MIN_TEXT_CHARS:
+            st.error(f"⚠️ בקובץ {f.name} אין שכבת טקסט (PDF סרוק) ולא ניתן לחלץ ממנו נתונים.")
+            continue
+        if not looks_like_pension_report(text):
+            st.error(f"⚠️ הקובץ {f.name} לא זוהה כדוח פנסיה תקני ולא נשלח לניתוח.")
+            continue
+        texts[k] = text
+    if texts and deferred:
+        try:
+            st.session_state["pending_batches"][submit_batch(client, texts)] = list(texts)
+            st.info(f"📨 {len(texts)} דוחות נשלחו לניתוח מושהה. התוצאות יוצגו כאן כשיהיו מוכנות.")
+        except APIError as e:
+            st.error(f"⚠️ שליחת {len(texts)} דוחות לניתוח מושהה נכשלה: {e}")
+            failed.update(texts)
+    elif texts:
+        results = dict(zip(texts, process_audit_batch(client, list(texts.values()))))
+        store_results(results)
+        failed.update([k for k, d in results.items() if not d])
+    return [cache.get(k, {}) for k in keys]
+
+# ממשק משתמש
+# אזור ההעלאה והניתוח כ-fragment: אינטראקציה בתוכו מריצה מחדש רק אותו ולא את כל הסקריפט
+@st.fragment
+def analysis_fragment(client):
+    uploads = st.file_uploader("העלה דוח PDF", type="pdf", accept_multiple_files=True)
+    deferred = st.toggle("ניתוח מושהה (Batch) - חצי מחיר, תוצאה תוך עד 24 שעות")
+    # אצוות ששולמו נבדקות גם כשהמעלה ריק - התוצאות נשמרות במאגר ויוצגו כשהקובץ יועלה שוב
+    in_batch = poll_batches(client)
+    files = []
+    for f in uploads:
+        if is_pdf_upload(f): files.append(f)
+        else: st.error(f"⚠️ הקובץ {f.name} אינו PDF תקין ולא יעובד.")
+    if files:
         with st.spinner("מעתיק נתונים כפי שהם (ללא שיקול דעת AI)..."):
-            raw_text = "\n".join([page.get_text() for page in fitz.open(stream=file.read(), filetype="pdf")])
-            data = process_audit_v28(client, raw_text)
+            results = process_uploads(client, files, in_batch, deferred)
             
-            if data:
+            for file, data in zip(files, results):
+                if not data: continue
+                if len(files) > 1: st.header(file.name)
                 perform_cross_validation(data)
                 # סדר עמודות: תיאור ראשון (ימין ב-RTL)
-                display_pension_table(data.get("table_a", {}).get("rows"), "א. תשלומים צפויים", ["תיאור", "סכום בש\"ח"])
-                display_pension_table(data.get("table_b", {}).get("rows"), "ב. תנועות בקרן", ["תיאור", "סכום בש\"ח"])
-                display_pension_table(data.get("table_c", {}).get("rows"), "ג. דמי ניהול והוצאות", ["תיאור", "אחוז"])
-                display_pension_table(data.get("table_d", {}).get("rows"), "ד. מסלולי השקעה", ["מסלול", "תשואה"])
-                display_pension_table(data.get("table_e", {}).get("rows"), "ה. פירוט הפקדות", ["שם המעסיק", "מועד", "חודש", "שכר", "עובד", "מעסיק", "פיצויים", "סה\"כ"])
+                for table, cols in _TABLE_COLUMNS.items():
+                    display_pension_table(data.get(table, {}).get("rows"), _TABLE_TITLES[table], cols)
+
+st.title("📋 חילוץ נתונים פנסיוני - גירסה 28.0")
+client = init_client()
+
+if client:
+    analysis_fragment(client)
 
 
 